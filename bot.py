@@ -1,77 +1,108 @@
-import os, re, sys
+import os, re, sys, io, asyncio, functools, hashlib
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta, date
 from typing import List, Dict
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 
-DAY_NAMES = ["Понеділок","Вівторок","Середа","Cереда","Четвер","П'ятниця","Субота","Неділя"]
-DAY_PATTERN = r"^(?P<dow>" + "|".join(map(re.escape, DAY_NAMES)) + r")\s+(?P<date>\d{1,2}\.\d{1,2})\s*$"
-day_re = re.compile(DAY_PATTERN)
+DAY_NAMES = ["Понеділок","Вівторок","Середа","Четвер","П'ятниця","Субота","Неділя"]
+DAY_ORDER = {n: i for i, n in enumerate(DAY_NAMES)}
+# day headers are always "<DayName> <dd.mm>": a set lookup on the first token beats a regex alternation
+DAY_SET = frozenset(DAY_NAMES)
+date_re = re.compile(r"\d{1,2}\.\d{1,2}")
 
 SHIFT_PATTERN = r"""^(?P<name>[\wА-Яа-яІіЇїЄє'’ -]+?)\s+
                      (?P<start>\d{1,2}:\d{2})-(?P<end>\d{1,2}:\d{2})
                      (?:\s*\((?P<bstart>\d{1,2}:\d{2})-(?P<bend>\d{1,2}:\d{2})\))?$
                   """
 shift_re = re.compile(SHIFT_PATTERN, re.X)
+ws_re = re.compile(r"\s{2,}")
+# "Середа" typed with a Latin "C" is normalized once for the whole text
+lookalike_re = re.compile(r"\bCереда\b")
 
 # --- Табель helpers ---
-def hhmm_to_dt(s: str) -> datetime:
-    h, m = map(int, s.split(":"))
-    return datetime(2000,1,1,h,m)
-
-def compute_tabulated_hours(start, end, dow: str) -> float:
-    sdt, edt = hhmm_to_dt(start), hhmm_to_dt(end)
-    if dow in ["Субота","Неділя"]:
-        legal_start, legal_end = hhmm_to_dt("09:00"), hhmm_to_dt("19:00")
+def hhmm_to_mins(s: str) -> int:
+    h, m = s.split(":")
+    return int(h)*60 + int(m)
+
+# shift times repeat a lot across employees/weeks, so results are memoized per string pair
+@functools.lru_cache(maxsize=512)
+def compute_duration_hours(start: str, end: str) -> float:
+    return round((hhmm_to_mins(end)-hhmm_to_mins(start))/60.0,2)
+
+def dow_bucket(dow: str) -> str:
+    return "we" if dow in ("Субота","Неділя") else "wd"
+
+@functools.lru_cache(maxsize=512)
+def tabulated_minutes(start: str, end: str, bucket: str) -> int:
+    smin, emin = hhmm_to_mins(start), hhmm_to_mins(end)
+    if bucket == "we":
+        legal_start, legal_end = 9*60, 19*60
     else:
-        legal_start, legal_end = hhmm_to_dt("08:00"), hhmm_to_dt("20:00")
-    sdt = max(sdt, legal_start)
-    edt = min(edt, legal_end)
-    if edt <= sdt:
-        return 0.0
-    hours = (edt - sdt).total_seconds()/3600.0
-    if hours >= 6:
-        hours -= 1
-    return round(hours,2)
+        legal_start, legal_end = 8*60, 20*60
+    smin = max(smin, legal_start)
+    emin = min(emin, legal_end)
+    if emin <= smin:
+        return 0
+    mins = emin - smin
+    if mins >= 6*60:
+        mins -= 60
+    return mins
 
 # --- Parsing schedule text ---
+def set_day_label(b: Dict):
+    # day totals are summed as integer hundredths of the per-entry tab_hours, so the label
+    # agrees with the detail/summary sheets and no float drift accumulates
+    b["total_hours"] = b.pop("total_cents")/100
+    b["day_label"] = f"{b['dow']}  {b['date_obj'].strftime('%d.%m')} ({int(round(b['total_hours']))}год.)"
+
 def parse_blocks_for_text(raw_text: str, year: int) -> List[Dict]:
-    lines = [ln.strip() for ln in raw_text.splitlines()]
+    raw_text = lookalike_re.sub("Середа", raw_text)
     blocks, current = [], None
-    for ln in lines:
+    for ln in raw_text.splitlines():
+        if ln[:1].isspace() or ln[-1:].isspace():
+            ln = ln.strip()
         if not ln: continue
-        m = day_re.match(ln)
-        if m:
-            dow = m.group("dow").replace("Cереда","Середа")
-            ddmm = m.group("date")
-            current = {"dow": dow, "date": ddmm, "entries": []}
+        ln = ws_re.sub(" ", ln)
+        parts = ln.split(None, 1)
+        if len(parts) == 2 and parts[0] in DAY_SET and date_re.fullmatch(parts[1]):
+            dow, ddmm = parts
+            if current is not None: set_day_label(current)
+            dd, mm = ddmm.split(".")
+            dt = date(year, int(mm), int(dd))
+            current = {"dow": dow, "date": ddmm, "date_obj": dt, "date_iso": dt.isoformat(),
+                       "entries": [], "total_cents": 0}
+            bucket = dow_bucket(dow)
             blocks.append(current); continue
         if current is None: continue
-        m2 = shift_re.match(re.sub(r"\s{2,}", " ", ln))
-        if m2:
-            d = m2.groupdict()
-            name = re.sub(r"\s{2,}", " ", d["name"]).strip()
-            start, end = d["start"], d["end"]
-            raw = (hhmm_to_dt(end)-hhmm_to_dt(start)).total_seconds()/3600.0
-            tab = compute_tabulated_hours(start,end,current["dow"])
-            current["entries"].append({
-                "name": name,
-                "start": start, "end": end,
-                "bstart": d.get("bstart"), "bend": d.get("bend"),
-                "raw_hours": round(raw,2),
-                "tab_hours": tab
-            })
-    for b in blocks:
-        dt = datetime.strptime(f"{b['date']}.{year}", "%d.%m.%Y").date()
-        b["date_iso"] = dt.isoformat()
-        b["total_hours"] = sum(e["tab_hours"] for e in b["entries"])
+        m = shift_re.match(ln)
+        if m is None: continue
+        d = m.groupdict()
+        name = d["name"].strip()
+        start, end = d["start"], d["end"]
+        raw = compute_duration_hours(start,end)
+        tab_mins = tabulated_minutes(start,end,bucket)
+        # tab_mins*100/60 never lands on .5, so this equals round(tab_mins/60, 2) exactly
+        tab_cents = (tab_mins*100 + 30)//60
+        tab = tab_cents/100
+        current["entries"].append({
+            "name": name,
+            "start": start, "end": end,
+            "bstart": d.get("bstart"), "bend": d.get("bend"),
+            "raw_hours": raw,
+            "tab_hours": tab
+        })
+        current["total_cents"] += tab_cents
+    # the label carries the day total, so it is set once a block is complete
+    if current is not None: set_day_label(current)
     return blocks
 
 def anchor_monday(min_date: date, user_anchor: str|None) -> date:
     if user_anchor:
         try:
-            d = datetime.strptime(user_anchor,"%Y-%m-%d").date()
+            d = date.fromisoformat(user_anchor)
             if d.weekday()!=0: d -= timedelta(days=d.weekday())
             return d
         except: pass
@@ -79,91 +110,101 @@ def anchor_monday(min_date: date, user_anchor: str|None) -> date:
 
 def assign_weeks(blocks: List[Dict], first_monday: date):
     for b in blocks:
-        d = datetime.fromisoformat(b["date_iso"]).date()
-        b["week"] = 1+((d-first_monday).days//7)
+        b["week"] = 1+((b["date_obj"]-first_monday).days//7)
 
 # --- Build DataFrames ---
-def build_week_df(blocks: List[Dict], week_no:int) -> pd.DataFrame:
-    rows=[]
-    week_blocks=sorted([b for b in blocks if b["week"]==week_no], key=lambda x:x["date_iso"])
+def build_week_columns(blocks: List[Dict], week_no:int) -> List[List[str]]:
+    col_day,col_name,col_hours,col_break=[],[],[],[]
+    week_blocks=sorted([b for b in blocks if b["week"]==week_no], key=lambda x:x["date_obj"])
     for b in week_blocks:
-        day_label=f"{b['dow']}  {datetime.fromisoformat(b['date_iso']).strftime('%d.%m')} ({int(round(b['total_hours']))}год.)"
-        first=True
+        day_label=b["day_label"]
         for e in b["entries"]:
             brk=f"{e['bstart']}-{e['bend']}" if e.get("bstart") and e.get("bend") else ""
-            rows.append({
-                "День": day_label if first else "",
-                "Працівник": e["name"],
-                "Робочі години": f"{e['start']}-{e['end']}",
-                "Перерва": brk
-            }); first=False
-        rows.append({"День":"","Працівник":"","Робочі години":"","Перерва":""})
-    if not rows: rows=[{"День":"","Працівник":"","Робочі години":"","Перерва":""}]
-    return pd.DataFrame(rows)
+            col_day.append(day_label); day_label=""
+            col_name.append(e["name"])
+            col_hours.append(f"{e['start']}-{e['end']}")
+            col_break.append(brk)
+        col_day.append(""); col_name.append(""); col_hours.append(""); col_break.append("")
+    if not col_day: col_day,col_name,col_hours,col_break=[""],[""],[""],[""]
+    return [col_day,col_name,col_hours,col_break]
 
 def build_wide_weeks(blocks,weeks:int)->pd.DataFrame:
-    week_tables={w:build_week_df(blocks,w) for w in range(1,weeks+1)}
-    max_rows=max((df.shape[0] for df in week_tables.values()),default=0)
-    padded=[]
+    week_cols={w:build_week_columns(blocks,w) for w in range(1,weeks+1)}
+    max_rows=max((len(cols[0]) for cols in week_cols.values()),default=0)
+    columns,names=[],[]
     for w in range(1,weeks+1):
-        df=week_tables[w]
-        if df.shape[0]<max_rows:
-            pad=pd.DataFrame([{ "День":"","Працівник":"","Робочі години":"","Перерва":""}]*(max_rows-df.shape[0]))
-            df=pd.concat([df,pad],ignore_index=True)
-        df.columns=[f"{w}й тиждень","Працівник","Робочі години","Перерва"]
-        padded.append(df)
-    return pd.concat(padded,axis=1) if padded else pd.DataFrame()
+        for col in week_cols[w]:
+            col.extend([""]*(max_rows-len(col)))
+            columns.append(col)
+        names+=[f"{w}й тиждень","Працівник","Робочі години","Перерва"]
+    if not columns: return pd.DataFrame()
+    # positional keys first: the week headers repeat "Працівник" etc.
+    return pd.DataFrame(dict(enumerate(columns)),copy=False).set_axis(names,axis=1)
 
 def build_detail(blocks: List[Dict])->pd.DataFrame:
-    rows=[]
+    n=sum(len(b["entries"]) for b in blocks)
+    dates=np.empty(n,dtype="datetime64[s]")
+    weeks_c=np.empty(n,dtype=np.int64)
+    dows,names,starts,ends,bstarts,bends=(np.empty(n,dtype=object) for _ in range(6))
+    raw_h=np.empty(n,dtype=np.float64)
+    tab_h=np.empty(n,dtype=np.float64)
+    i=0
     for b in blocks:
         for e in b["entries"]:
-            rows.append({
-                "Дата": datetime.fromisoformat(b["date_iso"]),
-                "Тиждень": b["week"],
-                "День тижня": b["dow"],
-                "Працівник": e["name"],
-                "Початок": e["start"], "Кінець": e["end"],
-                "Перерва початок": e.get("bstart") or "",
-                "Перерва кінець": e.get("bend") or "",
-                "Фіксовані години": e["raw_hours"],
-                "Табельні години": e["tab_hours"]
-            })
-    return pd.DataFrame(rows).sort_values(["Дата","Працівник"])
+            dates[i]=b["date_obj"]
+            weeks_c[i]=b["week"]
+            dows[i]=b["dow"]
+            names[i]=e["name"]
+            starts[i]=e["start"]; ends[i]=e["end"]
+            bstarts[i]=e.get("bstart") or ""
+            bends[i]=e.get("bend") or ""
+            raw_h[i]=e["raw_hours"]
+            tab_h[i]=e["tab_hours"]
+            i+=1
+    # sort by date, then employee (lexsort takes the primary key last)
+    order=np.lexsort((names,dates))
+    return pd.DataFrame({
+        "Дата": dates[order],
+        "Тиждень": weeks_c[order],
+        "День тижня": dows[order],
+        "Працівник": names[order],
+        "Початок": starts[order], "Кінець": ends[order],
+        "Перерва початок": bstarts[order],
+        "Перерва кінець": bends[order],
+        "Фіксовані години": raw_h[order],
+        "Табельні години": tab_h[order]
+    },copy=False)
 
 def build_summary(detail:pd.DataFrame,weeks:int)->pd.DataFrame:
     if detail.empty:
         return pd.DataFrame(columns=["Працівник"]+[f"Тиждень {i}" for i in range(1,weeks+1)]+["Всього (год)"])
-    pv=detail.pivot_table(index="Працівник",columns="Тиждень",values="Табельні години",aggfunc="sum",fill_value=0)
+    pv=detail.groupby(["Працівник","Тиждень"])["Табельні години"].sum().unstack("Тиждень",fill_value=0)
     pv=pv.reindex(columns=list(range(1,weeks+1)),fill_value=0)
     pv.columns=[f"Тиждень {c}" for c in pv.columns]
-    pv["Всього (год)"]=pv.sum(axis=1).round(2)
+    pv["Всього (год)"]=pv.to_numpy().sum(axis=1).round(2)
     return pv.reset_index()
 # function to calculate working days summary
 def build_working_days_summary(blocks: List[Dict]) -> pd.DataFrame:
-    rows = []
+    names, weeks, dows, hours = [], [], [], []
     for b in blocks:
         for e in b["entries"]:
-            rows.append({
-                "Працівник": e["name"],
-                "Тиждень": b["week"],
-                "День": b["dow"],
-                "Дата": datetime.fromisoformat(b["date_iso"]),
-                "Години": e["tab_hours"]
-            })
-    df = pd.DataFrame(rows)
+            names.append(e["name"])
+            weeks.append(b["week"])
+            dows.append(b["dow"])
+            hours.append(e["tab_hours"])
+    df = pd.DataFrame({"Працівник": names, "Тиждень": weeks, "День": dows, "Години": hours}, copy=False)
     if df.empty:
         return pd.DataFrame(columns=["Працівник", "Тиждень", "День", "Дата", "Години"])
     
-    # Group by employee and week, and aggregate the data
-    summary = (
-        df.groupby(["Працівник", "Тиждень"])
-        .agg(
-            Дні=("День", lambda x: ", ".join(sorted(set(x), key=DAY_NAMES.index))),
-            Години=("Години", "sum")
-        )
-        .reset_index()
-    )
+    # Order days within each employee/week once, then group without re-sorting;
+    # unique() keeps first-seen order so the day list comes out sorted
+    df["_day_ord"] = df["День"].map(DAY_ORDER)
+    df.sort_values(["Працівник", "Тиждень", "_day_ord"], inplace=True)
+    grp = df.groupby(["Працівник", "Тиждень"], sort=False)
+    summary = pd.DataFrame({
+        "Дні": grp["День"].unique().map(", ".join),
+        "Години": grp["Години"].sum()
+    }).reset_index()
     return summary
 DAY_ABBR = {
     "Понеділок": "Пн",
@@ -176,18 +217,17 @@ DAY_ABBR = {
 }
 
 def build_schedule_table(blocks: List[Dict]) -> pd.DataFrame:
-    rows = []
+    names, labels, hours = [], [], []
+    label_dates = {}
     for b in blocks:
+        day_label = b["date_obj"].strftime("%d/%m") + f" ({DAY_ABBR[b['dow']]})"
+        label_dates[day_label] = b["date_obj"]
         for e in b["entries"]:
-            dt = datetime.fromisoformat(b["date_iso"])
-            day_label = dt.strftime("%d/%m") + f" ({DAY_ABBR[b['dow']]})"
-            rows.append({
-                "Працівник": e["name"],
-                "Дата": day_label,
-                "Години": f"{e['start']}-{e['end']}"
-            })
-
-    df = pd.DataFrame(rows)
+            names.append(e["name"])
+            labels.append(day_label)
+            hours.append(f"{e['start']}-{e['end']}")
+
+    df = pd.DataFrame({"Працівник": names, "Дата": labels, "Години": hours}, copy=False)
     if df.empty:
         return pd.DataFrame(columns=["Працівник"])
 
@@ -201,29 +241,37 @@ def build_schedule_table(blocks: List[Dict]) -> pd.DataFrame:
         .reset_index()
     )
 
-    def parse_date(label: str) -> datetime:
-        return datetime.strptime(label.split()[0], "%d/%m")
-
     sorted_cols = ["Працівник"] + sorted(
         [c for c in schedule_table.columns if c != "Працівник"],
-        key=parse_date
+        key=label_dates.__getitem__
     )
 
     return schedule_table[sorted_cols]
 
 
+def write_sheet(book, name, df, header_fmt):
+    # constant_memory only keeps the current row, so cells must go out row by row
+    # (DataFrame.to_excel writes column by column and would lose data)
+    ws = book.add_worksheet(name)
+    ws.write_row(0, 0, list(df.columns), header_fmt)
+    for i, row in enumerate(df.fillna("").itertuples(index=False, name=None), start=1):
+        ws.write_row(i, 0, row)
+    return ws
+
 def write_excel(out_path,wide,detail,summary,working_days_summary,schedule_table):
-    with pd.ExcelWriter(out_path,engine="xlsxwriter") as writer:
-        if not wide.empty: wide.to_excel(writer,sheet_name="week",index=False)
-        if not detail.empty: detail.to_excel(writer,sheet_name="detail",index=False)
-        if not summary.empty: summary.to_excel(writer,sheet_name="summary",index=False)
-        if not working_days_summary.empty:working_days_summary.to_excel(writer, sheet_name="working days summary", index=False)
-        if not schedule_table.empty:schedule_table.to_excel(writer, sheet_name="schedule table", index=False)
-        for sheet in writer.sheets.values():
+    options={"constant_memory": True, "default_date_format": "yyyy-mm-dd hh:mm:ss"}
+    with pd.ExcelWriter(out_path,engine="xlsxwriter",engine_kwargs={"options": options}) as writer:
+        book=writer.book
+        header_fmt=book.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        if not wide.empty: write_sheet(book,"week",wide,header_fmt)
+        if not detail.empty: write_sheet(book,"detail",detail,header_fmt)
+        if not summary.empty: write_sheet(book,"summary",summary,header_fmt)
+        if not working_days_summary.empty: write_sheet(book,"working days summary",working_days_summary,header_fmt)
+        for sheet in book.worksheets():
             sheet.set_column(0,0,26); sheet.set_column(1,100,18)
-
-# --- Loggi  # apply formatting for schedule table
-            ws = writer.sheets["schedule table"]
+        if not schedule_table.empty:
+            # apply formatting for schedule table
+            ws = write_sheet(book,"schedule table",schedule_table,header_fmt)
             ws.freeze_panes(1, 1)  # freeze first row + first column
             ws.set_column(0, 0, 26)  # employee names wider
             ws.set_column(1, schedule_table.shape[1], 10)  # date columns narrower
@@ -231,22 +279,41 @@ def write_excel(out_path,wide,detail,summary,working_days_summary,schedule_table
 
 
 # --- Telegram bot state ---
-user_settings = {}
+# per-chat overrides only; chats without an entry use default_settings(). Oldest chats are evicted first
+user_settings: OrderedDict = OrderedDict()
+USER_SETTINGS_MAX = 10_000
+# finished workbooks keyed by (chat, text digest, year, weeks, anchor); oldest evicted first
+excel_cache: OrderedDict = OrderedDict()
+EXCEL_CACHE_SIZE = 32
 
 # --- Handlers ---
 from telegram import ReplyKeyboardMarkup, KeyboardButton
 
 from telegram import ReplyKeyboardMarkup, KeyboardButton
 
+MAIN_KEYBOARD = ReplyKeyboardMarkup(
+    [[KeyboardButton("ℹ️ Help"), KeyboardButton("🔄 Start")]],
+    resize_keyboard=True
+)
+
+def default_settings() -> Dict:
+    return {"year": datetime.now().year, "weeks": 4, "anchor": None}
+
+def editable_settings(chat_id: int) -> Dict:
+    settings = user_settings.get(chat_id)
+    if settings is None:
+        settings = user_settings[chat_id] = default_settings()
+        if len(user_settings) > USER_SETTINGS_MAX:
+            user_settings.popitem(last=False)
+    else:
+        user_settings.move_to_end(chat_id)
+    return settings
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, reset_only=False):
     chat_id = update.effective_chat.id
     # Reset settings
-    user_settings[chat_id] = {"year": datetime.now().year, "weeks": 4, "anchor": None}
-
-    keyboard = [
-        [KeyboardButton("ℹ️ Help"), KeyboardButton("🔄 Start")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    user_settings.pop(chat_id, None)
+    reply_markup = MAIN_KEYBOARD
 
     if reset_only:
         msg = "⚙️ Налаштування скинуто ✅\n👉 1. Введіть нові параметри.\n👉 2. Надішліть розклад як .txt файл або скористайтеся меню нижче 👇"
@@ -302,7 +369,7 @@ async def year_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         year = int(context.args[0])
-        user_settings[update.effective_chat.id]["year"] = year
+        editable_settings(update.effective_chat.id)["year"] = year
         await update.message.reply_text(f"✅ Рік змінено на {year} 📅")
     except:
         await update.message.reply_text("❌ Вкажіть рік, наприклад: /year 2025")
@@ -311,7 +378,7 @@ async def weeks_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         w = int(context.args[0])
-        user_settings[update.effective_chat.id]["weeks"] = w
+        editable_settings(update.effective_chat.id)["weeks"] = w
         await update.message.reply_text(f"✅ Кількість тижнів змінено на {w} 📆")
     except:
         await update.message.reply_text("❌ Вкажіть число, наприклад: /weeks 6")
@@ -320,7 +387,7 @@ async def anchor_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         d = datetime.strptime(context.args[0], "%Y-%m-%d").date()
-        user_settings[update.effective_chat.id]["anchor"] = d
+        editable_settings(update.effective_chat.id)["anchor"] = d
         await update.message.reply_text(f"✅ Початковий понеділок встановлено: {d} 📌")
     except:
         await update.message.reply_text("❌ Вкажіть дату у форматі YYYY-MM-DD")
@@ -340,7 +407,10 @@ async def txt_document_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("❌ Будь ласка, надішліть .txt файл 📂")
         return
     file = await doc.get_file()
-    text = (await file.download_as_bytearray()).decode("utf-8")
+    bio = io.BytesIO()
+    await file.download_to_memory(bio)
+    # decode straight from the buffer; bad bytes become U+FFFD instead of failing the upload
+    text = str(bio.getbuffer(), "utf-8", "replace")
     await process_schedule_and_reply(update, context, text)
 
 # --- Callback Query Handler ---
@@ -354,25 +424,41 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await start(update, context)
 
 # --- Core ---
-async def process_schedule_and_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
-    settings = user_settings.get(update.effective_chat.id, {"year": datetime.now().year, "weeks": 4, "anchor": None})
-    year = settings["year"]
+def build_excel_bytes(text: str, year: int, weeks: int, anchor: date|None) -> bytes|None:
+    # CPU-bound (parsing, pandas, xlsxwriter); runs in a worker thread
     blocks=parse_blocks_for_text(text,year)
     if not blocks:
-        await update.message.reply_text("Не вдалося розпізнати розклад")
-        return
-    min_date=min(datetime.fromisoformat(b["date_iso"]).date() for b in blocks)
-    first_monday=anchor_monday(min_date, settings["anchor"].isoformat() if settings["anchor"] else None)
+        return None
+    min_date=min(b["date_obj"] for b in blocks)
+    first_monday=anchor_monday(min_date, anchor.isoformat() if anchor else None)
     assign_weeks(blocks,first_monday)
-    weeks=settings["weeks"]
     wide=build_wide_weeks(blocks,weeks)
     detail=build_detail(blocks)
     summary=build_summary(detail,weeks)
     working_days_summary = build_working_days_summary(blocks)
     schedule_table = build_schedule_table(blocks)
-    out_path="schedule.xlsx"
-    write_excel(out_path,wide,detail,summary,working_days_summary,schedule_table)
-    await update.message.reply_document(open(out_path,"rb"), filename="schedule.xlsx")
+    # build in memory: a shared file on disk would be clobbered by concurrent chats
+    bio=io.BytesIO()
+    write_excel(bio,wide,detail,summary,working_days_summary,schedule_table)
+    return bio.getvalue()
+
+async def process_schedule_and_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    settings = user_settings.get(update.effective_chat.id) or default_settings()
+    year, weeks, anchor = settings["year"], settings["weeks"], settings["anchor"]
+    key=(update.effective_chat.id, hashlib.blake2b(text.encode(),digest_size=16).digest(), year, weeks, anchor)
+    data=excel_cache.get(key)
+    if data is not None:
+        excel_cache.move_to_end(key)
+        await update.message.reply_document(data, filename="schedule.xlsx")
+        return
+    data=await asyncio.to_thread(build_excel_bytes,text,year,weeks,anchor)
+    if data is None:
+        await update.message.reply_text("Не вдалося розпізнати розклад")
+        return
+    excel_cache[key]=data
+    if len(excel_cache)>EXCEL_CACHE_SIZE:
+        excel_cache.popitem(last=False)
+    await update.message.reply_document(data, filename="schedule.xlsx")
 
 # --- Main ---
 def main():
@@ -386,7 +472,8 @@ def main():
         print(f"BOT_TOKEN is set: {token[:4]}... (truncated for security)")
 
 
-    app = Application.builder().token(token).build()
+    # let other chats' updates run while a workbook is being built in a thread
+    app = Application.builder().token(token).concurrent_updates(True).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("year", year_cmd))